@@ -1,86 +1,246 @@
 import openai
 import requests
+from requests.adapters import HTTPAdapter, Retry
 import logging
 import random
+import asyncio
+from array import array
+import functools
+import itertools
 import datetime
+import hashlib
 import time
-import json
+import orjson  # Ensure orjson is installed: pip install orjson
 import os
+import aiohttp  # Ensure aiohttp is installed: pip install aiohttp
+import diskcache  # Ensure diskcache is installed: pip install diskcache
 import yfinance as yf  # Ensure yfinance is installed: pip install yfinance
+import numba  # Ensure numba is installed: pip install numba
+import numpy as np
 import pandas as pd
 
 # Set up logging for production-level traceability.
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s [%(levelname)s] %(message)s")
 
+# Simulation dates repeat heavily within a day and strftime is a
+# locale-aware C call, so memoize the formatted string per date.
+@functools.lru_cache(maxsize=512)
+def _date_str(d):
+    return d.strftime("%Y-%m-%d")
+
+# Integer codes for recommendation actions inside the numeric kernel.
+_ACTION_CODES = {"HOLD": 0, "BUY": 1, "SELL": 2}
+_ACTION_NAMES = ("HOLD", "BUY", "SELL")
+
+# One day's trade decisions as pure arithmetic over SoA arrays, compiled
+# by Numba; I/O, logging, and the LLM stay in Python. Replicates the
+# sequential semantics of the original loop: earlier buys deplete the
+# cash available to later ones. Returns the per-symbol share deltas
+# (positive = buy, negative = sell all) and the resulting cash.
+@numba.njit(cache=True)
+def apply_decisions(prices, buy_limits, sell_limits, actions, holdings, cash):
+    n = prices.shape[0]
+    share_deltas = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        price = prices[i]
+        if actions[i] == 1 and price <= buy_limits[i]:
+            shares = int(cash // price)
+            if shares > 0:
+                share_deltas[i] = shares
+                cash -= shares * price
+        elif actions[i] == 2 and price >= sell_limits[i]:
+            if holdings[i] > 0:
+                share_deltas[i] = -holdings[i]
+                cash += holdings[i] * price
+    return share_deltas, cash
+
 # Portfolio class to manage cash, holdings, and trade transactions.
 class Portfolio:
+    _FLUSH_EVERY = 100  # trade records between explicit log flushes
+
     def __init__(self, initial_cash=100000):
         self.cash = initial_cash
         self.holdings = {}  # mapping symbol -> number of shares
-        self.transactions = []  # record of all transactions
+        # Share counts mirrored into an aligned float64 vector so
+        # get_value is one dot product instead of a Python loop.
+        self._sym_index = {}  # mapping symbol -> position in _shares
+        self._shares = np.zeros(0, dtype=np.float64)
+        # Transaction log stored column-wise: typed arrays for the numeric
+        # fields instead of one dict per trade, so long runs stay compact
+        # and each column is already contiguous for reporting.
+        self._tx = {
+            "date": [],
+            "symbol": [],
+            "action": [],
+            "price": array("d"),
+            "shares": array("q")
+        }
+        # Append-only NDJSON trade log: every record is persisted as it
+        # happens, so long runs survive crashes and the history is usable
+        # without waiting for the run to finish. Flushed in batches to
+        # amortize the write syscall.
+        self._log_f = open("transactions.ndjson", "ab")
+        self._unflushed = 0
+
+    @property
+    def transactions(self):
+        # Materialize the columnar log as a DataFrame for reporting.
+        return pd.DataFrame(self._tx)
+
+    def _adjust_shares(self, symbol, delta):
+        i = self._sym_index.get(symbol)
+        if i is None:
+            # First trade in this symbol; grow the vector by one slot.
+            i = self._sym_index[symbol] = len(self._sym_index)
+            self._shares = np.append(self._shares, 0.0)
+        self._shares[i] += delta
+
+    def _record(self, trade_date, symbol, action, price, shares):
+        date_iso = trade_date.isoformat()
+        self._tx["date"].append(date_iso)
+        self._tx["symbol"].append(symbol)
+        self._tx["action"].append(action)
+        self._tx["price"].append(price)
+        self._tx["shares"].append(shares)
+        self._log_f.write(orjson.dumps({
+            "date": date_iso,
+            "symbol": symbol,
+            "action": action,
+            "price": price,
+            "shares": shares
+        }))
+        self._log_f.write(b"\n")
+        self._unflushed += 1
+        if self._unflushed >= self._FLUSH_EVERY:
+            self._log_f.flush()
+            self._unflushed = 0
+
+    def close(self):
+        self._log_f.flush()
+        self._log_f.close()
 
     def buy(self, symbol, price, shares, trade_date):
+        date_str = _date_str(trade_date)
         cost = price * shares
         if self.cash < cost:
             logging.warning("[%s] Insufficient cash to buy %d shares of %s at %.2f",
-                            trade_date.strftime("%Y-%m-%d"), shares, symbol, price)
+                            date_str, shares, symbol, price)
             return False
         self.cash -= cost
         self.holdings[symbol] = self.holdings.get(symbol, 0) + shares
-        self.transactions.append({
-            "date": trade_date.isoformat(),
-            "symbol": symbol,
-            "action": "BUY",
-            "price": price,
-            "shares": shares
-        })
-        logging.info("[%s] Bought %d shares of %s at %.2f", 
-                     trade_date.strftime("%Y-%m-%d"), shares, symbol, price)
+        self._adjust_shares(symbol, shares)
+        self._record(trade_date, symbol, "BUY", price, shares)
+        logging.info("[%s] Bought %d shares of %s at %.2f",
+                     date_str, shares, symbol, price)
         return True
 
     def sell(self, symbol, price, shares, trade_date):
+        date_str = _date_str(trade_date)
         if self.holdings.get(symbol, 0) < shares:
             logging.warning("[%s] Insufficient shares to sell %d shares of %s",
-                            trade_date.strftime("%Y-%m-%d"), shares, symbol)
+                            date_str, shares, symbol)
             return False
         self.holdings[symbol] -= shares
         self.cash += price * shares
-        self.transactions.append({
-            "date": trade_date.isoformat(),
-            "symbol": symbol,
-            "action": "SELL",
-            "price": price,
-            "shares": shares
-        })
-        logging.info("[%s] Sold %d shares of %s at %.2f", 
-                     trade_date.strftime("%Y-%m-%d"), shares, symbol, price)
+        self._adjust_shares(symbol, -shares)
+        self._record(trade_date, symbol, "SELL", price, shares)
+        logging.info("[%s] Sold %d shares of %s at %.2f",
+                     date_str, shares, symbol, price)
         return True
 
     def get_value(self, current_prices):
-        total_value = self.cash
-        for symbol, shares in self.holdings.items():
-            total_value += current_prices.get(symbol, 0) * shares
-        return total_value
+        if not self._sym_index:
+            return self.cash
+        price_vec = np.fromiter((current_prices.get(symbol, 0) for symbol in self._sym_index),
+                                dtype=np.float64, count=len(self._sym_index))
+        return self.cash + float(self._shares @ price_vec)
 
 # NewsFetcher fetches historical news using a news API.
 class NewsFetcher:
     def __init__(self, api_key=None):
         self.api_key = api_key
+        # Historical news for a past (symbol, date) never changes, so cache
+        # it on disk forever; re-runs of a backtest then skip the network.
+        self.cache = diskcache.Cache(".news_cache")
+        # One pooled session for the sync path: reusing connections skips
+        # the per-call TCP/TLS handshake, and transient failures retry with
+        # backoff at the transport layer.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=16, pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504])))
+        # One shared session/connection pool for all async fetches; created
+        # lazily because a session must be built inside a running loop.
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def fetch_news_async(self, symbol, simulation_date):
+        # Async counterpart of fetch_news; fanned out across symbols so one
+        # day's news costs a single concurrent round-trip instead of N.
+        date_str = _date_str(simulation_date)
+        cache_key = f"{symbol}:{date_str}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logging.info("[%s] Using cached news for %s", date_str, symbol)
+            return cached
+        if self.api_key:
+            url = (f"https://newsapi.org/v2/everything?q={symbol}&from={date_str}&to={date_str}"
+                   f"&sortBy=publishedAt&apiKey={self.api_key}")
+            try:
+                session = await self._get_session()
+                async with session.get(url) as response:
+                    data = await response.json()
+                if data.get("status") == "ok":
+                    articles = data.get("articles", [])
+                    logging.info("[%s] Fetched %d news articles for %s",
+                                 date_str, len(articles), symbol)
+                    articles = articles[:5]  # use top 5 articles for analysis
+                    self.cache.set(cache_key, articles, expire=None)
+                    return articles
+                else:
+                    logging.error("[%s] News API error for %s: %s", date_str, symbol, data)
+            except Exception as e:
+                logging.error("[%s] Exception fetching news for %s: %s", date_str, symbol, e)
+        # Fallback dummy news if API key is not provided or an error occurs
+        logging.info("[%s] Using dummy news for %s", date_str, symbol)
+        return [{
+            "title": f"Market update for {symbol} on {date_str}",
+            "description": "No API key provided or error occurred in fetching live news."
+        }]
 
     def fetch_news(self, symbol, simulation_date):
-        date_str = simulation_date.strftime("%Y-%m-%d")
+        date_str = _date_str(simulation_date)
+        cache_key = f"{symbol}:{date_str}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logging.info("[%s] Using cached news for %s", date_str, symbol)
+            return cached
         if self.api_key:
             url = (f"https://newsapi.org/v2/everything?q={symbol}&from={date_str}&to={date_str}"
                    f"&sortBy=publishedAt&apiKey={self.api_key}")
             try:
-                response = requests.get(url)
+                # Bound connect and read times so one slow call cannot
+                # stall the whole fetch pass.
+                response = self.session.get(url, timeout=(3, 10))
                 data = response.json()
                 if data.get("status") == "ok":
                     articles = data.get("articles", [])
-                    logging.info("[%s] Fetched %d news articles for %s", 
+                    logging.info("[%s] Fetched %d news articles for %s",
                                  date_str, len(articles), symbol)
-                    return articles[:5]  # use top 5 articles for analysis
+                    articles = articles[:5]  # use top 5 articles for analysis
+                    self.cache.set(cache_key, articles, expire=None)
+                    return articles
                 else:
                     logging.error("[%s] News API error for %s: %s", date_str, symbol, data)
             except Exception as e:
@@ -94,82 +254,197 @@ class NewsFetcher:
 
 # LLMAnalyzer uses OpenAI's API to provide trading recommendations.
 class LLMAnalyzer:
+    # Function specification for structured output; a sizeable constant
+    # dict, so build it once at class scope rather than per call.
+    _FUNCTIONS = [
+        {
+            "name": "trade_recommendation",
+            "description": "Return a trading recommendation with the following keys: symbol, buy_limit, sell_limit, and action.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "symbol": {
+                        "type": "string",
+                        "description": "The stock symbol."
+                    },
+                    "buy_limit": {
+                        "type": "number",
+                        "description": "The price below which the stock should be bought."
+                    },
+                    "sell_limit": {
+                        "type": "number",
+                        "description": "The price above which the stock should be sold."
+                    },
+                    "action": {
+                        "type": "string",
+                        "enum": ["BUY", "SELL", "HOLD"],
+                        "description": "The recommended action."
+                    }
+                },
+                "required": ["symbol", "buy_limit", "sell_limit", "action"]
+            }
+        }
+    ]
+
     def __init__(self, openai_api_key):
         self.openai_api_key = openai_api_key
-        openai.api_key = openai_api_key
+        # A single async client reuses its underlying HTTP connection pool
+        # across all concurrent analyze calls. Constructed lazily:
+        # AsyncOpenAI raises when no API key is configured, and keyless
+        # runs must still reach analyze's HOLD fallback at call time.
+        self._client = None
+        # Throttling: a bounded number of in-flight requests plus leaky
+        # buckets for requests-per-minute and tokens-per-minute, so large
+        # symbol universes saturate the quota without tripping 429s.
+        self.max_attempts = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+        self._sem = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENT", "8")))
+        self._max_rpm = float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "500"))
+        self._max_tpm = float(os.getenv("OPENAI_MAX_TOKENS_PER_MINUTE", "60000"))
+        self._request_capacity = self._max_rpm
+        self._token_capacity = self._max_tpm
+        self._last_refill = time.monotonic()
+        self._capacity_lock = asyncio.Lock()
+        # LLM output is near-deterministic for identical inputs, so cache
+        # recommendations on disk keyed by a hash of the full prompt inputs;
+        # retries and re-runs then skip the API entirely.
+        self._cache = diskcache.Cache(".llm_cache")
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(api_key=self.openai_api_key)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+    async def _consume_capacity(self, est_tokens):
+        # Refill both buckets from the elapsed time, then block until they
+        # can cover one request of est_tokens. An estimate above the
+        # per-minute limit could never be covered and would spin forever,
+        # so clamp it: a misconfigured (too low) limit then degrades to
+        # one request per minute instead of hanging.
+        est_tokens = min(est_tokens, self._max_tpm)
+        while True:
+            async with self._capacity_lock:
+                now = time.monotonic()
+                elapsed = now - self._last_refill
+                self._last_refill = now
+                self._request_capacity = min(
+                    self._max_rpm, self._request_capacity + self._max_rpm * elapsed / 60.0)
+                self._token_capacity = min(
+                    self._max_tpm, self._token_capacity + self._max_tpm * elapsed / 60.0)
+                if self._request_capacity >= 1 and self._token_capacity >= est_tokens:
+                    self._request_capacity -= 1
+                    self._token_capacity -= est_tokens
+                    return
+            await asyncio.sleep(0.1)
+
+    async def _create_completion(self, est_tokens, **kwargs):
+        # Rate-limited chat completion with exponential-backoff retry on
+        # rate limits and transient server errors.
+        async with self._sem:
+            last_error = None
+            for attempt in range(self.max_attempts):
+                await self._consume_capacity(est_tokens)
+                try:
+                    return await self.client.chat.completions.create(**kwargs)
+                except openai.RateLimitError as e:
+                    last_error = e
+                except openai.APIStatusError as e:
+                    if e.status_code < 500:
+                        raise
+                    last_error = e
+                except openai.APIConnectionError as e:
+                    last_error = e
+                if attempt + 1 == self.max_attempts:
+                    break  # out of attempts; no point backing off again
+                delay = min(60.0, 2.0 ** attempt) * (1.0 + random.random())
+                logging.warning("OpenAI request failed (%s); retrying in %.1fs (attempt %d/%d)",
+                                last_error, delay, attempt + 1, self.max_attempts)
+                await asyncio.sleep(delay)
+            raise last_error
+
+    async def _stream_completion(self, est_tokens, **kwargs):
+        # Stream the completion so this coroutine yields on every token
+        # instead of blocking the loop for the whole generation; slow
+        # completions then overlap cleanly with fast ones under gather.
+        # Returns (function_args, content) with the deltas reassembled.
+        stream = await self._create_completion(est_tokens, stream=True, **kwargs)
+        arg_chunks = []
+        content_chunks = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.function_call and delta.function_call.arguments:
+                arg_chunks.append(delta.function_call.arguments)
+            if delta.content:
+                content_chunks.append(delta.content)
+        return "".join(arg_chunks) or None, "".join(content_chunks)
 
-    def analyze(self, symbol, news_articles, current_price, simulation_date):
-        # Build a news summary.
-        news_summary = "\n".join(
+    def _build_request(self, symbol, news_articles, current_price, date_str):
+        # Build the full chat-completion request body; shared between the
+        # live path and the Batch API serializer. Assembled with one join
+        # over literal fragments to keep allocations off the hot path.
+        news_lines = [
             f"{article.get('title', 'No title')} - {article.get('description', 'No description')}"
-            for article in news_articles
-        )
-        date_str = simulation_date.strftime("%Y-%m-%d")
-        prompt = f"""
-You are an expert stock analyst. Given the following news and the current price for {symbol} on {date_str}:
-
-News:
-{news_summary}
-
-Current Price: {current_price}
-
-Based on this information, provide a trading recommendation optimized for profit.
-"""
-
-        # Define function specification for structured output.
-        functions = [
-            {
-                "name": "trade_recommendation",
-                "description": "Return a trading recommendation with the following keys: symbol, buy_limit, sell_limit, and action.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "symbol": {
-                            "type": "string",
-                            "description": "The stock symbol."
-                        },
-                        "buy_limit": {
-                            "type": "number",
-                            "description": "The price below which the stock should be bought."
-                        },
-                        "sell_limit": {
-                            "type": "number",
-                            "description": "The price above which the stock should be sold."
-                        },
-                        "action": {
-                            "type": "string",
-                            "enum": ["BUY", "SELL", "HOLD"],
-                            "description": "The recommended action."
-                        }
-                    },
-                    "required": ["symbol", "buy_limit", "sell_limit", "action"]
-                }
-            }
+            for article in itertools.islice(news_articles, 5)
         ]
+        prompt = "".join([
+            "\nYou are an expert stock analyst. Given the following news and the current price for ",
+            symbol, " on ", date_str, ":\n\nNews:\n",
+            "\n".join(news_lines),
+            "\n\nCurrent Price: ", str(current_price),
+            "\n\nBased on this information, provide a trading recommendation optimized for profit.\n",
+        ])
+
+        return {
+            "model": "gpt-4o",  # Ensure this or another function-calling supported model is used.
+            "messages": [{"role": "user", "content": prompt}],
+            "functions": self._FUNCTIONS,
+            "function_call": "auto",  # Automatically call the function if applicable.
+            "temperature": 0.5,
+            "max_tokens": 150
+        }
+
+    async def analyze(self, symbol, news_articles, current_price, simulation_date):
+        date_str = _date_str(simulation_date)
+        request = self._build_request(symbol, news_articles, current_price, date_str)
+
+        cache_key = hashlib.sha256(
+            f"{symbol}:{date_str}:{current_price}:{request['messages'][0]['content']}"
+            .encode("utf-8")).hexdigest()
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logging.info("[%s] Using cached LLM recommendation for %s", date_str, symbol)
+            return cached
 
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o",  # Ensure this or another function-calling supported model is used.
-                messages=[{"role": "user", "content": prompt}],
-                functions=functions,
-                function_call="auto",  # Automatically call the function if applicable.
-                temperature=0.5,
-                max_tokens=150
-            )
-            message = response.choices[0].message
-            print(message.function_call)
+            # Rough request-size estimate (~4 chars/token) plus the completion cap.
+            est_tokens = len(request["messages"][0]["content"]) // 4 + request["max_tokens"]
+            try:
+                function_args, content = await self._stream_completion(est_tokens, **request)
+            except TypeError:
+                # Some models reject streamed function calls; fall back to
+                # a single non-streamed completion.
+                response = await self._create_completion(est_tokens, **request)
+                message = response.choices[0].message
+                function_args = message.function_call.arguments if message.function_call else None
+                content = message.content or ""
+            logging.debug("function_call=%s", function_args)
             # Check if the model returned a function call.
-            if message.function_call:
-                function_args = message.function_call.arguments
+            if function_args:
                 try:
-                    recommendation = json.loads(function_args)
+                    recommendation = orjson.loads(function_args)
                 except Exception as e:
                     logging.error("[%s] Error parsing structured output for %s: %s", date_str, symbol, e)
                     recommendation = None
             else:
                 # Fallback: try parsing the message content as JSON.
                 try:
-                    recommendation = json.loads(message.get("content", ""))
+                    recommendation = orjson.loads(content)
                 except Exception as e:
                     logging.error("[%s] Error parsing output for %s: %s", date_str, symbol, e)
                     recommendation = None
@@ -177,6 +452,7 @@ Based on this information, provide a trading recommendation optimized for profit
             if recommendation is None:
                 raise ValueError("No valid recommendation returned.")
             logging.info("[%s] LLM recommendation for %s: %s", date_str, symbol, recommendation)
+            self._cache.set(cache_key, recommendation, expire=None)
             return recommendation
         except Exception as e:
             logging.error("[%s] LLM analysis failed for %s: %s", date_str, symbol, e)
@@ -188,55 +464,176 @@ Based on this information, provide a trading recommendation optimized for profit
                 "action": "HOLD"
             }
 
+    async def analyze_batch(self, symbols, news_lists, prices, simulation_date):
+        """Vectorized analyze over parallel sequences of symbols, article
+        lists, and prices; returns recommendations in input order. The
+        fan-out is capped by the analyzer's semaphore and rate buckets."""
+        return await asyncio.gather(*(
+            self.analyze(symbol, news_articles, price, simulation_date)
+            for symbol, news_articles, price in zip(symbols, news_lists, prices)
+        ))
+
+# BatchLLMAnalyzer runs whole backtests through the OpenAI Batch API, which is
+# half the per-token price of the live endpoint and far higher throughput when
+# the simulation does not need answers in real time.
+class BatchLLMAnalyzer(LLMAnalyzer):
+    POLL_INTERVAL = 30.0  # seconds between batch status polls
+
+    async def submit_batch(self, prompts_by_id):
+        """Upload one JSONL request per (id, prompt inputs) and start a batch.
+
+        prompts_by_id maps a caller-chosen custom id to a tuple of
+        (symbol, news_articles, current_price, simulation_date).
+        Returns the batch id to poll with await_batch.
+        """
+        lines = []
+        for custom_id, (symbol, news_articles, current_price, simulation_date) in prompts_by_id.items():
+            date_str = _date_str(simulation_date)
+            body = self._build_request(symbol, news_articles, current_price, date_str)
+            lines.append(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }))
+        batch_file = await self.client.files.create(
+            file=("requests.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logging.info("Submitted batch %s with %d requests", batch.id, len(lines))
+        return batch.id
+
+    async def await_batch(self, batch_id):
+        """Poll until the batch finishes and return {custom_id: recommendation}."""
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+            logging.info("Batch %s status: %s (%s)", batch_id, batch.status, batch.request_counts)
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+        content = await self.client.files.content(batch.output_file_id)
+        recommendations = {}
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            result = orjson.loads(line)
+            custom_id = result.get("custom_id")
+            try:
+                message = result["response"]["body"]["choices"][0]["message"]
+                if message.get("function_call"):
+                    recommendations[custom_id] = orjson.loads(message["function_call"]["arguments"])
+                else:
+                    recommendations[custom_id] = orjson.loads(message.get("content") or "")
+            except Exception as e:
+                logging.error("Could not parse batch result for %s: %s", custom_id, e)
+        logging.info("Batch %s returned %d recommendations", batch_id, len(recommendations))
+        return recommendations
+
 # StockMarketSimulator now uses real historical data via yfinance.
 class StockMarketSimulator:
     def __init__(self, symbols, start_date, end_date):
         self.symbols = symbols
-        self.historical_data = {}
-        # Download historical data for each symbol.
-        for symbol in symbols:
-            logging.info("Downloading historical data for %s from %s to %s", 
-                         symbol, start_date, end_date)
-            data = yf.download(symbol, start=start_date, end=end_date)
-            if data.empty:
-                logging.error("No data fetched for %s. Check symbol or date range.", symbol)
-            else:
-                # Ensure the index is a DatetimeIndex
-                data.index = pd.to_datetime(data.index)
-                self.historical_data[symbol] = data
+        # Download all symbols in one request and keep a single columnar
+        # copy: a float64 close matrix over a sorted datetime64 axis,
+        # indexed by searchsorted instead of pandas label dispatch.
+        logging.info("Downloading historical data for %s from %s to %s",
+                     ", ".join(symbols), start_date, end_date)
+        raw = yf.download(symbols, start=start_date, end=end_date,
+                          group_by="column", auto_adjust=False)["Close"]
+        if raw.empty:
+            logging.error("No data fetched for %s. Check symbols or date range.", symbols)
+        raw.index = pd.to_datetime(raw.index)
+        # Actual trading sessions in the window, so callers can iterate
+        # real market days instead of probing the calendar.
+        self.trading_days = [ts.to_pydatetime() for ts in raw.index]
+        self._dates = raw.index.values.astype("datetime64[ns]")
+        self._closes = raw.to_numpy(dtype="float64")
+        self._col = {symbol: i for i, symbol in enumerate(raw.columns)}
+        # Rolling cursor into _dates: simulation queries advance
+        # monotonically, so date resolution can walk forward from the last
+        # hit instead of binary-searching from scratch each time.
+        self._cursor = 0
+        # Resolve every calendar day in the download window to its price
+        # dict up front (one searchsorted over the whole range), so
+        # update_prices inside the simulation loop is a plain dict lookup.
+        # Consecutive calendar days that map to the same trading row share
+        # one dict.
+        self._prices_by_date = {}
+        if len(self._dates):
+            calendar = pd.date_range(raw.index[0], raw.index[-1], freq="D")
+            rows = np.searchsorted(self._dates, calendar.values, side="right") - 1
+            row_dicts = {}
+            for day, i in zip(calendar, rows):
+                if i < 0:
+                    continue
+                prices = row_dicts.get(i)
+                if prices is None:
+                    row = self._closes[i]
+                    prices = {symbol: float(row[col])
+                              for symbol, col in self._col.items()
+                              if not np.isnan(row[col])}
+                    row_dicts[i] = prices
+                self._prices_by_date[day.date()] = prices
+
+    def _row_index(self, simulation_date):
+        # Row of the most recent trading day at or before simulation_date,
+        # or -1 if the date precedes the data. The common forward access
+        # pattern advances the cursor linearly (amortized O(1)); only a
+        # backwards query pays a fresh binary search.
+        if not len(self._dates):
+            return -1
+        target = np.datetime64(simulation_date, "ns")
+        if target < self._dates[self._cursor]:
+            i = int(np.searchsorted(self._dates, target, side="right")) - 1
+            if i >= 0:
+                self._cursor = i
+            return i
+        while self._cursor + 1 < len(self._dates) and self._dates[self._cursor + 1] <= target:
+            self._cursor += 1
+        return self._cursor
 
     def get_price(self, symbol, simulation_date):
-        data = self.historical_data.get(symbol)
-        if data is None or data.empty:
+        col = self._col.get(symbol)
+        if col is None:
             raise ValueError(f"No historical data for {symbol}")
-        # Find the most recent available trading day at or before simulation_date.
-        # data.index is sorted. Use asof to find the nearest date.
-        nearest_date = data.index.asof(simulation_date)
-        if pd.isna(nearest_date):
-            logging.error("No trading data available for %s at or before %s", 
+        i = self._row_index(simulation_date)
+        if i < 0:
+            logging.error("No trading data available for %s at or before %s",
                           symbol, simulation_date)
             return None
-        price = data.loc[nearest_date]["Close"]
-        # If multiple values are returned (unlikely), take the first.
-        if isinstance(price, pd.Series):
-            price = price.iloc[0]
-        return price
+        price = self._closes[i, col]
+        if np.isnan(price):
+            return None
+        return float(price)
 
     def update_prices(self, simulation_date):
-        current_prices = {}
-        for symbol in self.symbols:
-            price = self.get_price(symbol, simulation_date)
-            if price is None:
-                logging.warning("Price for %s on %s not available.", 
-                                symbol, simulation_date.strftime("%Y-%m-%d"))
-                continue
-            current_prices[symbol] = price
-        logging.info("Historical prices for %s: %s", 
-                     simulation_date.strftime("%Y-%m-%d"), current_prices)
+        date_str = _date_str(simulation_date)
+        key = simulation_date.date() if isinstance(simulation_date, datetime.datetime) else simulation_date
+        current_prices = self._prices_by_date.get(key)
+        if current_prices is None:
+            # Dates outside the precomputed window fall back to the
+            # searchsorted path.
+            i = self._row_index(simulation_date)
+            if i < 0:
+                logging.warning("No prices available on or before %s.", date_str)
+                return {}
+            row = self._closes[i]
+            current_prices = {symbol: float(row[col])
+                              for symbol, col in self._col.items()
+                              if not np.isnan(row[col])}
+        logging.info("Historical prices for %s: %s", date_str, current_prices)
         return current_prices
 
 # The main trading logic that ties all components together.
-def main():
+async def main():
     # Configuration and environment setup.
     symbols = ["AAPL", "MSFT", "GOOG", "AMZN", "TSLA"]
     simulation_days = 1
@@ -245,6 +642,9 @@ def main():
     # Replace with your actual API keys or set them as environment variables.
     news_api_key = os.getenv("NEWS_API_KEY")  # e.g., from newsapi.org
     openai_api_key = os.getenv("OPENAI_API_KEY")
+    # Backtests should run as fast as the data allows; set REAL_TIME=1 to
+    # pace the loop against the wall clock instead.
+    real_time = os.getenv("REAL_TIME", "0") == "1"
 
     # Set simulation start and end dates.
     simulation_interval = 7
@@ -257,59 +657,109 @@ def main():
     # Instantiate system components.
     portfolio = Portfolio(initial_cash)
     news_fetcher = NewsFetcher(api_key=news_api_key)
-    llm_analyzer = LLMAnalyzer(openai_api_key=openai_api_key)
+    # Multi-day backtests are not real-time, so route every (date, symbol)
+    # prompt through the Batch API at half price; single-day runs keep the
+    # live per-call path.
+    use_batch = simulation_days > 1
+    if use_batch:
+        llm_analyzer = BatchLLMAnalyzer(openai_api_key=openai_api_key)
+    else:
+        llm_analyzer = LLMAnalyzer(openai_api_key=openai_api_key)
     market_simulator = StockMarketSimulator(symbols, yf_start, yf_end)
 
-    # Simulation loop: each iteration represents a historical trading day.
-    current_date = simulation_start_date
-    days_run = 0
-    while days_run < simulation_days:
-        # Only process if we have data (i.e. skip non-trading days)
+    batch_recommendations = None
+    if use_batch:
+        # Precompute every prompt up front and submit them as one batch
+        # before the trading loop starts.
+        prompts_by_id = {}
+        for probe_date in market_simulator.trading_days[:simulation_days]:
+            probe_prices = market_simulator.update_prices(probe_date)
+            probe_str = _date_str(probe_date)
+            for symbol in symbols:
+                if symbol in probe_prices:
+                    articles = news_fetcher.fetch_news(symbol, probe_date)
+                    prompts_by_id[f"{probe_str}:{symbol}"] = (
+                        symbol, articles, probe_prices[symbol], probe_date)
+        batch_id = await llm_analyzer.submit_batch(prompts_by_id)
+        batch_recommendations = await llm_analyzer.await_batch(batch_id)
+
+    # Simulation loop: iterate actual trading sessions directly, so
+    # weekends and holidays never enter the loop at all.
+    session_days = market_simulator.trading_days[:simulation_days]
+    for day_index, current_date in enumerate(session_days):
         current_prices = market_simulator.update_prices(current_date)
         if not current_prices:
-            logging.info("[%s] No trading data; skipping.", current_date.strftime("%Y-%m-%d"))
-            current_date += datetime.timedelta(days=1)
+            logging.info("[%s] No trading data; skipping.", _date_str(current_date))
             continue
 
-        date_str = current_date.strftime("%Y-%m-%d")
+        date_str = _date_str(current_date)
         logging.info("=== Trading Day: %s ===", date_str)
+
         for symbol in symbols:
             if symbol not in current_prices:
                 logging.info("[%s] Skipping %s due to missing price data.", date_str, symbol)
-                continue
-            # Fetch historical news for the simulation date.
-            articles = news_fetcher.fetch_news(symbol, current_date)
-            current_price = current_prices[symbol]
-            # Get trading recommendation from LLM based on news and price.
-            recommendation = llm_analyzer.analyze(symbol, articles, current_price, current_date)
-
-            # Execute trade if conditions are met.
-            action = recommendation.get("action", "HOLD").upper()
-            buy_limit = recommendation.get("buy_limit", current_price)
-            sell_limit = recommendation.get("sell_limit", current_price)
-            if action == "BUY" and current_price <= buy_limit:
-                # Determine maximum shares that can be purchased.
-                shares_to_buy = int(portfolio.cash // current_price)
-                if shares_to_buy > 0:
-                    portfolio.buy(symbol, current_price, shares_to_buy, current_date)
-            elif action == "SELL" and current_price >= sell_limit:
-                shares_to_sell = portfolio.holdings.get(symbol, 0)
-                if shares_to_sell > 0:
-                    portfolio.sell(symbol, current_price, shares_to_sell, current_date)
+        tradable = [s for s in symbols if s in current_prices]
+
+        if batch_recommendations is not None:
+            recommendations = []
+            for symbol in tradable:
+                recommendation = batch_recommendations.get(f"{date_str}:{symbol}")
+                if recommendation is None:
+                    logging.warning("[%s] No batch recommendation for %s; holding.",
+                                    date_str, symbol)
+                    recommendation = {
+                        "symbol": symbol,
+                        "buy_limit": current_prices[symbol] * 0.95,
+                        "sell_limit": current_prices[symbol] * 1.05,
+                        "action": "HOLD"
+                    }
+                recommendations.append(recommendation)
+        else:
+            # Fetch the day's news for every tradable symbol in one
+            # concurrent fan-out, then analyze them all with a single
+            # vectorized call; results come back in input order.
+            news_lists = await asyncio.gather(
+                *(news_fetcher.fetch_news_async(s, current_date) for s in tradable))
+            recommendations = await llm_analyzer.analyze_batch(
+                tradable, news_lists,
+                [current_prices[s] for s in tradable], current_date)
+
+        # Execute trades if conditions are met. The decision arithmetic
+        # runs through the compiled kernel on SoA arrays; the Python loop
+        # below only does bookkeeping and logging for symbols that traded.
+        prices_arr = np.array([current_prices[s] for s in tradable], dtype=np.float64)
+        buy_arr = np.array([rec.get("buy_limit", p) for rec, p in zip(recommendations, prices_arr)],
+                           dtype=np.float64)
+        sell_arr = np.array([rec.get("sell_limit", p) for rec, p in zip(recommendations, prices_arr)],
+                            dtype=np.float64)
+        actions_arr = np.array([_ACTION_CODES.get(rec.get("action", "HOLD").upper(), 0)
+                                for rec in recommendations], dtype=np.int64)
+        holdings_arr = np.array([portfolio.holdings.get(s, 0) for s in tradable], dtype=np.int64)
+        share_deltas, _ = apply_decisions(prices_arr, buy_arr, sell_arr,
+                                          actions_arr, holdings_arr, portfolio.cash)
+        for i, symbol in enumerate(tradable):
+            if share_deltas[i] > 0:
+                portfolio.buy(symbol, float(prices_arr[i]), int(share_deltas[i]), current_date)
+            elif share_deltas[i] < 0:
+                portfolio.sell(symbol, float(prices_arr[i]), int(-share_deltas[i]), current_date)
             else:
-                logging.info("[%s] No trade executed for %s; action: %s", 
-                             date_str, symbol, action)
+                logging.info("[%s] No trade executed for %s; action: %s",
+                             date_str, symbol, _ACTION_NAMES[actions_arr[i]])
         # Report the portfolio value at the end of the day.
         portfolio_value = portfolio.get_value(current_prices)
         logging.info("End of Day %s portfolio value: %.2f", date_str, portfolio_value)
-        days_run += 1
-        # Move to the next calendar day.
-        current_date += datetime.timedelta(days=simulation_interval)
-        # In production, you might wait until the next trading day; here we simulate with a short delay.
-        time.sleep(1)
+        if real_time and day_index + 1 < len(session_days):
+            # Pace against the wall clock: sleep until the next session
+            # date is reached. Backtests skip the wait entirely.
+            delay = (session_days[day_index + 1] - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
 
     final_value = portfolio.get_value(market_simulator.update_prices(simulation_end_date))
     logging.info("Trading simulation complete. Final portfolio value: %.2f", final_value)
+    await llm_analyzer.close()
+    await news_fetcher.close()
+    portfolio.close()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())